@@ -0,0 +1,193 @@
+"""Incremental sales rollups (product x hour / product x day).
+
+Every order lands in the bucket of its ``created_at`` (cohort bucketing):
+checkout, payment and expiry of the same order all hit the same bucket, so
+live events and a backfill from the ``orders`` table produce identical
+numbers. Updates are O(1); reads walk a bounded window of buckets and never
+touch order history.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+FIELDS = ("orders", "paid", "units", "revenue_idr", "expired")
+_HOUR = 3600
+_DAY = 24 * _HOUR
+
+
+def _ts(dt: datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+class SalesRollup:
+    def __init__(self, products: Iterable[str], tz_offset_hours: int = 0, hourly_retention_days: int = 14, seen_max: int = 20000):
+        self.products = list(products)
+        self.tz_offset = int(tz_offset_hours) * _HOUR
+        self.hourly_retention = int(hourly_retention_days) * _DAY
+        self.lock = threading.Lock()
+        self.hourly: Dict[int, Dict[str, List[int]]] = {}
+        self.daily: Dict[int, Dict[str, List[int]]] = {}
+        self.totals: Dict[str, List[int]] = {pid: [0] * len(FIELDS) for pid in self.products}
+        self.backfilled_at: Optional[datetime] = None
+        self._seen: "OrderedDict[tuple, None]" = OrderedDict()
+        self._seen_max = seen_max
+        self._buffer: Optional[List[tuple]] = None
+
+    def _hour_key(self, ts: int) -> int:
+        return ts - ts % _HOUR
+
+    def _day_key(self, ts: int) -> int:
+        local = ts + self.tz_offset
+        return local - local % _DAY - self.tz_offset
+
+    def _bump(self, pid: str, created: datetime, deltas: tuple):
+        if pid not in self.totals:
+            return
+        ts = _ts(created)
+        for table, key in ((self.hourly, self._hour_key(ts)), (self.daily, self._day_key(ts))):
+            row = table.setdefault(key, {}).setdefault(pid, [0] * len(FIELDS))
+            for i, d in enumerate(deltas):
+                row[i] += d
+        tot = self.totals[pid]
+        for i, d in enumerate(deltas):
+            tot[i] += d
+
+    def _once(self, order_id: Optional[str], event: str) -> bool:
+        # pollers can race to auto-cancel the same order; count each event once
+        if not order_id:
+            return True
+        key = (order_id, event)
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self._seen_max:
+            self._seen.popitem(last=False)
+        return True
+
+    def record_created(self, pid: str, created: datetime, order_id: Optional[str] = None):
+        with self.lock:
+            if self._once(order_id, "created"):
+                self._bump(pid, created, (1, 0, 0, 0, 0))
+
+    def record_paid(self, pid: str, created: datetime, qty: int, amount_idr: int, order_id: Optional[str] = None):
+        with self.lock:
+            if self._once(order_id, "paid"):
+                self._live(order_id, pid, created, (0, 1, int(qty), int(amount_idr), 0))
+
+    def record_expired(self, pid: str, created: datetime, order_id: Optional[str] = None):
+        with self.lock:
+            if self._once(order_id, "expired"):
+                self._live(order_id, pid, created, (0, 0, 0, 0, 1))
+
+    def _live(self, order_id: Optional[str], pid: str, created: datetime, deltas: tuple):
+        self._bump(pid, created, deltas)
+        if self._buffer is not None and order_id:
+            self._buffer.append((order_id, pid, created, deltas))
+
+    def begin_backfill(self):
+        """Start remembering paid/expired events until ``replace_window`` or ``end_backfill``.
+
+        A backfill may read an order as pending and then see its payment or
+        expiry arrive live; swapping in the scanned buckets would drop that
+        event, so ``replace_window`` replays it for the orders it is told about.
+        """
+        with self.lock:
+            self._buffer = []
+
+    def end_backfill(self):
+        with self.lock:
+            self._buffer = None
+
+    def add_order_row(self, pid: str, created: datetime, status: str, qty: int, amount_idr: int):
+        paid = status == "paid"
+        self._bump(pid, created, (1, int(paid), int(qty) if paid else 0, int(amount_idr) if paid else 0, int(status == "cancelled")))
+
+    def prune(self, now: datetime):
+        cutoff = _ts(now) - self.hourly_retention
+        with self.lock:
+            for key in [k for k in self.hourly if k < cutoff]:
+                del self.hourly[key]
+
+    def day_start(self, dt: datetime) -> datetime:
+        """Start of the local (``tz_offset``) day containing ``dt``, in UTC."""
+        return datetime.fromtimestamp(self._day_key(_ts(dt)), timezone.utc)
+
+    def replace_window(self, other: "SalesRollup", start: datetime, cutoff: datetime, replay: Iterable[str] = ()):
+        """Adopt ``other``'s buckets for orders created in ``[start, cutoff)``.
+
+        ``start`` must be a day boundary (see ``day_start``) and ``cutoff`` an
+        hour boundary. Buckets outside the window keep what they had: older
+        history survives a backfill with a shorter window, and buckets at or
+        after the cutoff keep their live counts, so a backfill can run while
+        traffic is flowing. The day that contains the cutoff is merged from
+        both sides; totals are rebuilt from the daily table. Events buffered
+        since ``begin_backfill`` for orders in ``replay`` (the ones the scan
+        read as pending) are applied again on top.
+        """
+        lo, cut = _ts(start), _ts(cutoff)
+        with self.lock:
+            hourly = {k: v for k, v in self.hourly.items() if k < lo or k >= cut}
+            hourly.update({k: v for k, v in other.hourly.items() if lo <= k < cut})
+            daily = {}
+            for k in set(self.daily) | set(other.daily):
+                if k < lo or k >= cut:
+                    rows = self.daily.get(k)
+                elif k + _DAY <= cut:
+                    rows = other.daily.get(k)
+                else:
+                    # day straddles the cutoff: rebuild it from the hourly side of each rollup
+                    rows = {}
+                    for src, keep in ((other.hourly, lambda h: h < cut), (self.hourly, lambda h: h >= cut)):
+                        for h, per in src.items():
+                            if keep(h) and self._day_key(h) == k:
+                                for pid, vals in per.items():
+                                    acc = rows.setdefault(pid, [0] * len(FIELDS))
+                                    for i, v in enumerate(vals):
+                                        acc[i] += v
+                if rows:
+                    daily[k] = {pid: list(vals) for pid, vals in rows.items()}
+            totals = {pid: [0] * len(FIELDS) for pid in self.products}
+            for per in daily.values():
+                for pid, vals in per.items():
+                    if pid in totals:
+                        for i, v in enumerate(vals):
+                            totals[pid][i] += v
+            self.hourly, self.daily, self.totals = hourly, daily, totals
+            replay = set(replay)
+            for order_id, pid, created, deltas in self._buffer or ():
+                if order_id in replay and lo <= _ts(created) < cut:
+                    self._bump(pid, created, deltas)
+            self._buffer = None
+            self.backfilled_at = datetime.now(timezone.utc)
+
+    def _rows(self, table: Dict[int, Dict[str, List[int]]], keys: Iterable[int], label: str) -> List[dict]:
+        out = []
+        for key in keys:
+            per = table.get(key)
+            if not per:
+                continue
+            for pid in self.products:
+                vals = per.get(pid)
+                if vals:
+                    out.append(dict({label: datetime.fromtimestamp(key, timezone.utc).isoformat(), "product_id": pid}, **_fmt(vals)))
+        return out
+
+    def snapshot(self, now: datetime, hours: int = 48, days: int = 30) -> dict:
+        ts = _ts(now)
+        h0, d0 = self._hour_key(ts), self._day_key(ts)
+        with self.lock:
+            return {
+                "totals": {pid: _fmt(vals) for pid, vals in self.totals.items()},
+                "hourly": self._rows(self.hourly, (h0 - i * _HOUR for i in range(hours)), "hour"),
+                "daily": self._rows(self.daily, (d0 - i * _DAY for i in range(days)), "day"),
+                "backfilled_at": self.backfilled_at.isoformat() if self.backfilled_at else None,
+            }
+
+
+def _fmt(vals: List[int]) -> dict:
+    d = dict(zip(FIELDS, vals))
+    d["expiry_rate"] = round(d["expired"] / d["orders"], 4) if d["orders"] else 0.0
+    return d
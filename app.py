@@ -1,14 +1,29 @@
 import os
+import io
+import csv
+import json
+import zlib
+import hashlib
 import uuid
 import random
 import time
+import heapq
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple, Iterator, Iterable, Set, TYPE_CHECKING
 from string import Template
 
-from fastapi import FastAPI, Request, Query
-from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, JSONResponse
-from supabase import create_client, Client
+import analytics
+import profiler
+from backend_health import BackendUnavailable, CircuitOpen, GuardedClient, CircuitBreaker
+from collections import OrderedDict
+from fastapi import FastAPI, Request, Query, UploadFile, File, Form
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, JSONResponse, StreamingResponse
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
@@ -17,15 +32,88 @@ ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "ganti-tokenmu")
 if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
     print("WARNING: SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY belum di-set / tidak terbaca")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-app = FastAPI()
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+SUPABASE_TIMEOUT_SEC = float(os.getenv("SUPABASE_TIMEOUT_SEC", "4"))
+SUPABASE_HEDGE_MS = float(os.getenv("SUPABASE_HEDGE_MS", "300"))
+SUPABASE_HEDGE_RATIO = float(os.getenv("SUPABASE_HEDGE_RATIO", "0.1"))
+BREAKER_FAILS = int(os.getenv("BREAKER_FAILS", "5"))
+BREAKER_COOLDOWN_SEC = float(os.getenv("BREAKER_COOLDOWN_SEC", "10"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+PROFILE_MAX_SEC = 60
+_SUPABASE_CLIENT: Optional["Client"] = None
+_SUPABASE_LOCK = threading.Lock()
+_PROCESS_T0 = time.time()
+_BACKEND_READY_AT: Optional[float] = None
+
+
+def get_supabase() -> "Client":
+    # Importing supabase (httpx/httpcore/gotrue/realtime...) and building the
+    # client costs ~0.5s; do it on first use or in the warm-up thread so a
+    # cold /ping after wake doesn't pay for it.
+    global _SUPABASE_CLIENT, _BACKEND_READY_AT
+    if _SUPABASE_CLIENT is None:
+        with _SUPABASE_LOCK:
+            if _SUPABASE_CLIENT is None:
+                from supabase import create_client, ClientOptions
+                # transport timeout a bit above the guard's so abandoned worker threads still finish
+                _SUPABASE_CLIENT = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, options=ClientOptions(postgrest_client_timeout=int(SUPABASE_TIMEOUT_SEC) + 2))
+                _BACKEND_READY_AT = time.time()
+                print(f"[BOOT] supabase client ready {(_BACKEND_READY_AT - _PROCESS_T0) * 1000:.0f}ms after import")
+    return _SUPABASE_CLIENT
+
+
+supabase = GuardedClient(get_supabase, timeout=SUPABASE_TIMEOUT_SEC, hedge_after=SUPABASE_HEDGE_MS / 1000.0 if SUPABASE_HEDGE_MS > 0 else None, hedge_ratio=SUPABASE_HEDGE_RATIO, breaker=CircuitBreaker(BREAKER_FAILS, BREAKER_COOLDOWN_SEC), observer=lambda dt: profiler.add_phase("backend", dt))
+SLOW_LOG = profiler.SlowRequestLog(threshold_ms=SLOW_REQUEST_MS)
+_PROFILE_LOCK = threading.Lock()
+
+
+def _warm_up():
+    # independent steps: a slow Supabase at boot must not skip the rest
+    for name, step in (("client", get_supabase), ("ledger", ledger_reconcile), ("stats", _backfill_once), ("pages", lambda: [_static_page(p) for p in ("faq", "cek-order")])):
+        try:
+            step()
+        except Exception as e:
+            print(f"[BOOT] warm-up {name} err:", e)
+
+
+def _backfill_once():
+    # boot backfill; _ledger_loop retries it until one run has succeeded
+    if STATS_BACKFILL_DAYS > 0 and ROLLUP.backfilled_at is None:
+        backfill_rollup()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # uvicorn only starts accepting after startup returns, so the warm-up runs
+    # in the background instead of blocking the first /ping.
+    if WARMUP_ON_START:
+        threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+    if LEDGER_RECONCILE_SEC > 0:
+        threading.Thread(target=_ledger_loop, name="ledger-reconcile", daemon=True).start()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(profiler.SlowRequestMiddleware, log=SLOW_LOG, skip=("/admin/profile", "/admin/export"))
+
+
+@app.exception_handler(BackendUnavailable)
+async def backend_unavailable(request: Request, exc: BackendUnavailable):
+    if not isinstance(exc, CircuitOpen):
+        print(f"[BACKEND] {request.url.path}: {exc}")
+    headers = {"Retry-After": str(int(BREAKER_COOLDOWN_SEC))}
+    if request.url.path.startswith("/api/"):
+        return JSONResponse({"ok": False, "error": "backend_unavailable"}, status_code=503, headers=headers)
+    return HTMLResponse("<h3>Server sedang sibuk</h3><p>Sistem pembayaran sedang gangguan sementara. Coba lagi dalam beberapa saat, order kamu tetap aman.</p>", status_code=503, headers=headers)
 
 
 def _tpl_render(tpl, **kw) -> str:
+    t0 = time.perf_counter()
     s = tpl.template if hasattr(tpl, "template") else str(tpl)
     for k, v in kw.items():
         s = s.replace(f"${{{k}}}", str(v))
         s = s.replace(f"${k}", str(v))
+    profiler.add_phase("render", time.perf_counter() - t0)
     return s
 
 
@@ -69,6 +157,20 @@ RATE_MAX_CHECKOUT = 6
 _IP_BUCKET: Dict[str, list] = {}
 _VISITOR_SESS: Dict[str, float] = {}
 _VISITOR_BASE = 120
+STATS_TZ_OFFSET_HOURS = int(os.getenv("STATS_TZ_OFFSET_HOURS", "7"))
+STATS_BACKFILL_DAYS = int(os.getenv("STATS_BACKFILL_DAYS", "30"))
+LEDGER_RECONCILE_SEC = int(os.getenv("LEDGER_RECONCILE_SEC", "60"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_CODE_LEN = 500
+ROLLUP = analytics.SalesRollup(PRODUCTS.keys(), tz_offset_hours=STATS_TZ_OFFSET_HOURS)
+_BACKFILL_LOCK = threading.Lock()
+ORDER_CACHE_MAX = 5000
+_ORDER_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+_ORDER_CACHE_LOCK = threading.Lock()
+_LAST_STOCK: Dict[str, int] = {}
+_LAST_SOLD: Dict[str, int] = {}
+EXPORT_COLUMNS = ["id", "created_at", "product_id", "product_name", "qty", "unit", "amount_idr", "status"]
 
 
 def now_utc() -> datetime:
@@ -120,26 +222,41 @@ def _ensure_not_expired(order: dict) -> Tuple[dict, bool]:
         return order, False
     created = _parse_dt(order.get("created_at", "")) or now_utc()
     if now_utc() - created > timedelta(minutes=ORDER_TTL_MINUTES):
+        order = dict(order, status="cancelled")
         try:
             supabase.table("orders").update({"status": "cancelled"}).eq("id", order["id"]).execute()
         except Exception as e:
+            # the row is still pending in the DB: show it as cancelled for this
+            # response only, so the next poll retries the auto-cancel
             print("[AUTO_CANCEL] err:", e)
-        order["status"] = "cancelled"
+            return order, True
+        ledger_release(order["id"])
+        ROLLUP.record_expired(order.get("product_id", ""), created, order["id"])
+        _remember_order({"id": order["id"], "status": "cancelled"})
         return order, True
     return order, False
 
 
-def get_stock_map() -> Dict[str, int]:
+def _fetch_stock_map() -> Dict[str, int]:
     stock = {pid: 0 for pid in PRODUCTS.keys()}
+    res = supabase.table("vouchers").select("product_id").eq("status", "available").execute()
+    for row in (res.data or []):
+        pid = row.get("product_id")
+        if pid in stock:
+            stock[pid] += 1
+    return stock
+
+
+def get_stock_map() -> Dict[str, int]:
     try:
-        res = supabase.table("vouchers").select("product_id").eq("status", "available").execute()
-        for row in (res.data or []):
-            pid = row.get("product_id")
-            if pid in stock:
-                stock[pid] += 1
+        stock = _fetch_stock_map()
+        _LAST_STOCK.update(stock)
+        return stock
+    except BackendUnavailable:
+        pass
     except Exception as e:
         print("[STOCK] err:", e)
-    return stock
+    return {pid: _LAST_STOCK.get(pid, 0) for pid in PRODUCTS.keys()}
 
 
 def get_sold_map() -> Dict[str, int]:
@@ -150,9 +267,75 @@ def get_sold_map() -> Dict[str, int]:
             pid = row.get("product_id")
             if pid in sold:
                 sold[pid] += 1
+        _LAST_SOLD.update(sold)
+        return sold
+    except BackendUnavailable:
+        pass
     except Exception as e:
         print("[SOLD] err:", e)
-    return sold
+    return {pid: _LAST_SOLD.get(pid, 0) for pid in PRODUCTS.keys()}
+
+
+def get_stock_sold_maps() -> Tuple[Dict[str, int], Dict[str, int]]:
+    # one vouchers round trip for pages that show both counters, so a slow
+    # backend costs at most one guard timeout per request
+    stock = {pid: 0 for pid in PRODUCTS.keys()}
+    sold = {pid: 0 for pid in PRODUCTS.keys()}
+    try:
+        res = supabase.table("vouchers").select("product_id,status").in_("status", ["available", "used"]).execute()
+        for row in (res.data or []):
+            pid = row.get("product_id")
+            if pid in stock:
+                if row.get("status") == "available":
+                    stock[pid] += 1
+                else:
+                    sold[pid] += 1
+        _LAST_STOCK.update(stock)
+        _LAST_SOLD.update(sold)
+        return stock, sold
+    except BackendUnavailable:
+        pass
+    except Exception as e:
+        print("[STOCK] err:", e)
+    return {pid: _LAST_STOCK.get(pid, 0) for pid in PRODUCTS.keys()}, {pid: _LAST_SOLD.get(pid, 0) for pid in PRODUCTS.keys()}
+
+
+def _remember_order(order: dict):
+    oid = order.get("id")
+    if not oid:
+        return
+    with _ORDER_CACHE_LOCK:
+        cur = _ORDER_CACHE.pop(oid, {})
+        cur.update(order)
+        _ORDER_CACHE[oid] = cur
+        if len(_ORDER_CACHE) > ORDER_CACHE_MAX:
+            _ORDER_CACHE.popitem(last=False)
+
+
+def _cached_order(order_id: str) -> Optional[dict]:
+    with _ORDER_CACHE_LOCK:
+        o = _ORDER_CACHE.get(order_id)
+        return dict(o) if o else None
+
+
+def fetch_order(order_id: str) -> Optional[dict]:
+    # paid/cancelled are terminal, so a cached copy is as good as the DB;
+    # pending orders are re-read (admin may have verified them) and fall
+    # back to the last-known copy while Supabase is unavailable.
+    cached = _cached_order(order_id)
+    if cached and (cached.get("status") or "").lower() in ("paid", "cancelled"):
+        return cached
+    try:
+        res = supabase.table("orders").select("*").eq("id", order_id).limit(1).execute()
+    except BackendUnavailable:
+        if cached:
+            return cached
+        raise
+    if not res.data:
+        return None
+    order = res.data[0]
+    _remember_order(order)
+    return dict(order)
 
 
 def claim_vouchers_for_order(order_id: str, product_id: str, qty: int) -> Optional[list[str]]:
@@ -178,9 +361,149 @@ def claim_vouchers_for_order(order_id: str, product_id: str, qty: int) -> Option
         for vid in ids:
             supabase.table("vouchers").update({"status": "used"}).eq("id", vid).execute()
     supabase.table("orders").update({"status": "paid", "voucher_code": "\n".join(codes) if codes else None}).eq("id", order_id).execute()
+    ledger_commit(order_id, product_id, len(codes))
+    _remember_order({"id": order_id, "status": "paid", "voucher_code": "\n".join(codes) if codes else None})
     return codes
 
 
+# Stock reservation ledger. free = available (vouchers in DB) - reserved
+# (qty held by pending orders). Checkout reserves under one lock, so N
+# concurrent buyers can never be handed more units than exist, and it does
+# not need a vouchers scan. The DB stays the source of truth: the ledger is
+# seeded from it and reconciled every LEDGER_RECONCILE_SEC in the background.
+# Per-process state, like _IP_BUCKET: assumes a single uvicorn worker.
+_LEDGER_LOCK = threading.Lock()
+_LEDGER_SYNC_LOCK = threading.Lock()
+_LEDGER_AVAIL: Dict[str, int] = {}
+_LEDGER_RESERVED: Dict[str, int] = {}
+_LEDGER_HELD: Dict[str, Tuple[str, int, float]] = {}
+_LEDGER_EXPIRY: list = []
+_LEDGER_VERSION = 0
+_LEDGER_SYNCED_AT = 0.0
+
+
+def _ledger_sweep(t: float):
+    while _LEDGER_EXPIRY and _LEDGER_EXPIRY[0][0] <= t:
+        exp, oid = heapq.heappop(_LEDGER_EXPIRY)
+        held = _LEDGER_HELD.get(oid)
+        if held and held[2] == exp:
+            _ledger_drop(oid)
+            # unpaid past its TTL; most such orders are never polled again,
+            # so count the expiry here (_once dedups a later auto-cancel)
+            ROLLUP.record_expired(held[0], datetime.fromtimestamp(exp - ORDER_TTL_MINUTES * 60, timezone.utc), oid)
+
+
+def _ledger_drop(order_id: str) -> Optional[Tuple[str, int, float]]:
+    held = _LEDGER_HELD.pop(order_id, None)
+    if held:
+        pid, qty, _ = held
+        _LEDGER_RESERVED[pid] = max(0, _LEDGER_RESERVED.get(pid, 0) - qty)
+    return held
+
+
+def _ledger_hold(order_id: str, pid: str, qty: int, expires: float):
+    _LEDGER_HELD[order_id] = (pid, qty, expires)
+    _LEDGER_RESERVED[pid] = _LEDGER_RESERVED.get(pid, 0) + qty
+    heapq.heappush(_LEDGER_EXPIRY, (expires, order_id))
+
+
+def ledger_reconcile(force: bool = True) -> bool:
+    global _LEDGER_SYNCED_AT
+    with _LEDGER_SYNC_LOCK:
+        if not force and _LEDGER_SYNCED_AT:
+            return True
+        with _LEDGER_LOCK:
+            version = _LEDGER_VERSION
+        started = time.time()
+        avail = _fetch_stock_map()
+        since = (now_utc() - timedelta(minutes=ORDER_TTL_MINUTES)).isoformat()
+        res = supabase.table("orders").select("id,product_id,qty,created_at").eq("status", "pending").gte("created_at", since).execute()
+        pending = {}
+        for o in (res.data or []):
+            pid = o.get("product_id")
+            if pid not in PRODUCTS:
+                continue
+            created = _parse_dt(o.get("created_at", "")) or now_utc()
+            pending[o["id"]] = (pid, max(1, int(o.get("qty") or 1)), created.timestamp() + ORDER_TTL_MINUTES * 60)
+        with _LEDGER_LOCK:
+            if version != _LEDGER_VERSION and _LEDGER_SYNCED_AT:
+                # a claim/restock landed mid-scan; the snapshot may miss it, retry next round
+                return False
+            # count expiries of holds that lapsed since the last sweep before they are rebuilt
+            _ledger_sweep(time.time())
+            _LEDGER_AVAIL.clear()
+            _LEDGER_AVAIL.update(avail)
+            # keep holds placed after the scan started: their order row may not have been visible yet
+            recent = {oid: h for oid, h in _LEDGER_HELD.items() if h[2] - ORDER_TTL_MINUTES * 60 >= started}
+            _LEDGER_HELD.clear()
+            _LEDGER_RESERVED.clear()
+            _LEDGER_EXPIRY.clear()
+            pending.update(recent)
+            for oid, (pid, qty, exp) in pending.items():
+                _ledger_hold(oid, pid, qty, exp)
+            _ledger_sweep(time.time())
+            _LEDGER_SYNCED_AT = time.time()
+        return True
+
+
+def ledger_reserve(order_id: str, product_id: str, qty: int) -> int:
+    if not _LEDGER_SYNCED_AT:
+        # no seed means unknown stock, not zero stock: let the error surface
+        # (BackendUnavailable -> 503) instead of telling buyers "Stok habis"
+        try:
+            ledger_reconcile(force=False)
+        except Exception as e:
+            print("[LEDGER] seed err:", e)
+            raise
+    t = time.time()
+    with _LEDGER_LOCK:
+        _ledger_sweep(t)
+        free = _LEDGER_AVAIL.get(product_id, 0) - _LEDGER_RESERVED.get(product_id, 0)
+        qty = min(int(qty), free)
+        if qty <= 0:
+            return 0
+        _ledger_hold(order_id, product_id, qty, t + ORDER_TTL_MINUTES * 60)
+        return qty
+
+
+def ledger_release(order_id: str):
+    with _LEDGER_LOCK:
+        _ledger_drop(order_id)
+
+
+def ledger_commit(order_id: str, product_id: str, qty: int):
+    global _LEDGER_VERSION
+    with _LEDGER_LOCK:
+        _ledger_drop(order_id)
+        _LEDGER_AVAIL[product_id] = max(0, _LEDGER_AVAIL.get(product_id, 0) - int(qty))
+        _LEDGER_VERSION += 1
+
+
+def ledger_restock(product_id: str, qty: int):
+    global _LEDGER_VERSION
+    with _LEDGER_LOCK:
+        _LEDGER_AVAIL[product_id] = _LEDGER_AVAIL.get(product_id, 0) + int(qty)
+        _LEDGER_VERSION += 1
+
+
+def ledger_snapshot() -> Dict[str, dict]:
+    with _LEDGER_LOCK:
+        _ledger_sweep(time.time())
+        return {pid: {"available": _LEDGER_AVAIL.get(pid, 0), "reserved": _LEDGER_RESERVED.get(pid, 0), "free": max(0, _LEDGER_AVAIL.get(pid, 0) - _LEDGER_RESERVED.get(pid, 0))} for pid in PRODUCTS}
+
+
+def _ledger_loop():
+    while True:
+        time.sleep(LEDGER_RECONCILE_SEC)
+        try:
+            ledger_reconcile()
+        except Exception as e:
+            print("[LEDGER] reconcile err:", e)
+        try:
+            _backfill_once()
+        except Exception as e:
+            print("[STATS] backfill err:", e)
+
 BASE_STYLE = Template(r'''
 :root{
   --bg:#030304;
@@ -263,7 +586,215 @@ FAQ_HTML = Template(r'''<!doctype html><html lang="id"><head><meta charset="utf-
 
 LOOKUP_HTML = Template(r'''<!doctype html><html lang="id"><head><meta charset="utf-8"/><meta name="viewport" content="width=device-width, initial-scale=1"/><title>Cek Order</title><style>'''+BASE_STYLE.template+r'''body{padding-bottom:40px}</style></head><body><header class="site-header"><div class="wrap header-inner"><div class="brand-row"><a class="menu-btn" href="/"><span></span></a><div class="logo-shell"><img class="logo" src="$logo" alt="Logo"/></div><div class="brand-copy"><h1 class="glow-text">Cek Status Pesanan</h1><div class="tag">Masukkan Order ID untuk melihat status pesanan</div></div></div></div></header><div class="wrap"><div class="panel neon lookup-box"><div class="eyebrow"><span class="dot"></span> Lookup Order</div><h2 style="margin:14px 0 8px">Cek status hanya dengan Order ID</h2><div class="muted">Masukkan Order ID yang kamu dapat saat checkout, lalu tekan tombol cek.</div><form onsubmit="event.preventDefault(); goCheck();" style="margin-top:16px; display:grid; gap:12px"><input id="oidInput" class="input" placeholder="Contoh: 123e4567-e89b-12d3-a456-426614174000" autocomplete="off"/><button class="btn primary" data-glitch="Cek Status" type="submit">Cek Status</button></form><div class="muted" style="margin-top:12px">Tip: kamu bisa salin-tempel Order ID dari halaman pembayaran atau halaman status order.</div></div></div><script>function goCheck(){const v=(document.getElementById('oidInput').value||'').trim();if(!v){alert('Masukkan Order ID terlebih dahulu');return;}window.location.href='/status/'+encodeURIComponent(v);}</script></body></html>''')
 
-ADMIN_HTML = Template(r'''<!doctype html><html lang="id"><head><meta name="viewport" content="width=device-width, initial-scale=1"/><title>Admin Panel</title><style>body{font-family:ui-sans-serif,system-ui,-apple-system,"Segoe UI",Roboto,Arial;background:#070c18;color:#fff;padding:20px}.box{max-width:980px;margin:0 auto}.row{background:rgba(255,255,255,.06);border:1px solid rgba(255,255,255,.12);padding:14px;border-radius:16px;margin-bottom:10px;display:flex;gap:12px;align-items:center;justify-content:space-between;backdrop-filter: blur(10px)}.muted{opacity:.75;font-size:12px;word-break:break-all}.vbtn{background:#22c55e;border:none;color:#fff;padding:10px 12px;border-radius:12px;cursor:pointer;font-weight:950}.lbtn{display:inline-block;background:rgba(255,255,255,.06);border:1px solid rgba(255,255,255,.12);color:white;padding:10px 12px;border-radius:12px;text-decoration:none;font-weight:950}.act{min-width:260px;display:flex;flex-direction:column;align-items:flex-end;gap:8px}@media(max-width:740px){.row{flex-direction:column;align-items:flex-start}.act{align-items:flex-start;min-width:unset;width:100%}}</style></head><body><div class="box"><h2 style="margin:0 0 10px;">Admin Panel</h2><div style="opacity:.75;margin-bottom:12px;">Klik tombol untuk verifikasi + otomatis assign akun email lalu redirect ke halaman akun email.</div>$items</div></body></html>''')
+ADMIN_HTML = Template(r'''<!doctype html><html lang="id"><head><meta name="viewport" content="width=device-width, initial-scale=1"/><title>Admin Panel</title><style>body{font-family:ui-sans-serif,system-ui,-apple-system,"Segoe UI",Roboto,Arial;background:#070c18;color:#fff;padding:20px}.box{max-width:980px;margin:0 auto}.row{background:rgba(255,255,255,.06);border:1px solid rgba(255,255,255,.12);padding:14px;border-radius:16px;margin-bottom:10px;display:flex;gap:12px;align-items:center;justify-content:space-between;backdrop-filter: blur(10px)}.muted{opacity:.75;font-size:12px;word-break:break-all}.vbtn{background:#22c55e;border:none;color:#fff;padding:10px 12px;border-radius:12px;cursor:pointer;font-weight:950}.lbtn{display:inline-block;background:rgba(255,255,255,.06);border:1px solid rgba(255,255,255,.12);color:white;padding:10px 12px;border-radius:12px;text-decoration:none;font-weight:950}.act{min-width:260px;display:flex;flex-direction:column;align-items:flex-end;gap:8px}@media(max-width:740px){.row{flex-direction:column;align-items:flex-start}.act{align-items:flex-start;min-width:unset;width:100%}}</style></head><body><div class="box"><h2 style="margin:0 0 10px;">Admin Panel</h2><div style="opacity:.75;margin-bottom:12px;">Klik tombol untuk verifikasi + otomatis assign akun email lalu redirect ke halaman akun email.</div><div style="display:flex;gap:8px;flex-wrap:wrap;margin-bottom:12px;"><a class="lbtn" href="/admin/export?token=$token&fmt=csv">Export CSV</a><a class="lbtn" href="/admin/export?token=$token&fmt=ndjson&gz=1">Export NDJSON (gz)</a><a class="lbtn" href="/admin/stats?token=$token">Statistik Penjualan</a><a class="lbtn" href="/admin/slow?token=$token">Request Lambat</a><a class="lbtn" href="/admin/profile?token=$token&seconds=10">Profil 10 detik</a></div><form class="row" method="post" action="/admin/vouchers/import?token=$token" enctype="multipart/form-data"><div class="col"><b>Restock akun email</b><div class="muted">File .txt (1 kode per baris) atau .csv dengan kolom code (opsional product_id). Duplikat otomatis dilewati.</div></div><div class="act"><select name="product_id" class="lbtn">$product_options</select><input type="file" name="file" accept=".txt,.csv,text/plain,text/csv" required/><button class="vbtn" type="submit">IMPORT</button></div></form>$items</div></body></html>''')
+
+def _pgrst_quote(v: str) -> str:
+    return '"' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def iter_orders_keyset(start: datetime, end: datetime, page_size: int = EXPORT_PAGE_SIZE) -> Iterator[dict]:
+    # Keyset pagination on (created_at, id): each page is an index seek, so
+    # cost and memory stay flat no matter how deep into the range we are
+    # (unlike offset paging, which re-scans every skipped row).
+    cols = "id,product_id,qty,unit,amount_idr,status,created_at"
+    last_ts, last_id = start.isoformat(), None
+    while True:
+        q = supabase.table("orders").select(cols).gte("created_at", last_ts).lt("created_at", end.isoformat())
+        if last_id is not None:
+            q = q.or_(f"created_at.gt.{_pgrst_quote(last_ts)},and(created_at.eq.{_pgrst_quote(last_ts)},id.gt.{_pgrst_quote(last_id)})")
+        rows = q.order("created_at", desc=False).order("id", desc=False).limit(page_size).execute().data or []
+        # stop on an empty page, not a short one: PostgREST's max-rows caps
+        # every page when page_size is set above it
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_ts, last_id = rows[-1]["created_at"], rows[-1]["id"]
+
+
+def _export_row(o: dict) -> dict:
+    pid = o.get("product_id", "")
+    return {
+        "id": o.get("id"),
+        "created_at": o.get("created_at"),
+        "product_id": pid,
+        "product_name": PRODUCTS.get(pid, {}).get("name", pid),
+        "qty": int(o.get("qty") or 1),
+        "unit": int(o.get("unit") or 0),
+        "amount_idr": int(o.get("amount_idr") or 0),
+        "status": (o.get("status") or "pending").lower(),
+    }
+
+
+def iter_orders_export(rows: Iterator[dict], fmt: str, batch: int = EXPORT_PAGE_SIZE) -> Iterator[bytes]:
+    buf = io.StringIO()
+    if fmt == "csv":
+        w = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS, lineterminator="\n")
+        w.writeheader()
+    n = 0
+    for o in rows:
+        row = _export_row(o)
+        if fmt == "csv":
+            w.writerow(row)
+        else:
+            buf.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+            buf.write("\n")
+        n += 1
+        if n % batch == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def gzip_stream(chunks: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def _code_key(code: str) -> int:
+    # 64-bit digest instead of the full code: the index is independent of code
+    # length and costs ~60 bytes per voucher (set slot + int), ~18 MB for 300k.
+    # Collision odds at that size are ~1e-9, and a collision only skips a code.
+    return int.from_bytes(hashlib.blake2b(code.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def load_voucher_code_index(page_size: int = EXPORT_PAGE_SIZE) -> Set[int]:
+    index: Set[int] = set()
+    last_id = None
+    while True:
+        q = supabase.table("vouchers").select("id,code")
+        if last_id is not None:
+            q = q.gt("id", last_id)
+        rows = q.order("id", desc=False).limit(page_size).execute().data or []
+        if not rows:
+            # a short page may just be PostgREST's max-rows cap
+            return index
+        for row in rows:
+            if row.get("code"):
+                index.add(_code_key(row["code"]))
+        last_id = rows[-1]["id"]
+
+
+def iter_voucher_lines(lines: Iterable[str]) -> Iterator[Tuple[Optional[str], str]]:
+    # Plain text: one code per line, taken verbatim (codes may contain commas).
+    # CSV: only when the first line is a header with a "code" column; an
+    # optional "product_id" column overrides the target product per row.
+    it = iter(lines)
+    first = next(it, None)
+    if first is None:
+        return
+    header = [h.strip().lower() for h in next(csv.reader([first]))]
+    if "code" in header:
+        ci = header.index("code")
+        pi = header.index("product_id") if "product_id" in header else None
+        for row in csv.reader(it):
+            if len(row) > ci:
+                yield (row[pi].strip() if pi is not None and len(row) > pi else None), row[ci].strip()
+        return
+    yield None, first.strip()
+    for line in it:
+        yield None, line.strip()
+
+
+def import_vouchers(lines: Iterable[str], product_id: str, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    t0 = time.time()
+    # seed the ledger before inserting, so the restock below lands on a real
+    # count (restock.py and a cold process have never reconciled)
+    ledger_reconcile(force=False)
+    index = load_voucher_code_index()
+    index_sec = time.time() - t0
+    stats = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0, "batches": 0}
+    batch = []
+
+    added: Dict[str, int] = {}
+
+    def flush():
+        if batch:
+            supabase.table("vouchers").insert(batch).execute()
+            for row in batch:
+                added[row["product_id"]] = added.get(row["product_id"], 0) + 1
+            stats["inserted"] += len(batch)
+            stats["batches"] += 1
+            batch.clear()
+
+    for pid, code in iter_voucher_lines(lines):
+        if not code:
+            continue
+        stats["read"] += 1
+        pid = pid or product_id
+        if pid not in PRODUCTS or len(code) > IMPORT_MAX_CODE_LEN:
+            stats["invalid"] += 1
+            continue
+        key = _code_key(code)
+        if key in index:
+            stats["duplicates"] += 1
+            continue
+        index.add(key)
+        batch.append({"product_id": pid, "code": code, "status": "available"})
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    for pid, n in added.items():
+        ledger_restock(pid, n)
+    sec = time.time() - t0
+    stats.update({
+        "ok": True,
+        "added": added,
+        "index_size": len(index),
+        "index_sec": round(index_sec, 3),
+        "seconds": round(sec, 3),
+        "rows_per_sec": round(stats["read"] / sec, 1) if sec > 0 else 0.0,
+        "stock": {pid: v["free"] for pid, v in ledger_snapshot().items()},
+    })
+    print(f"[IMPORT] {', '.join(f'{pid} +{n}' for pid, n in added.items()) or 'nothing added'}: dup={stats['duplicates']} invalid={stats['invalid']} in {sec:.2f}s")
+    return stats
+
+
+def backfill_rollup(days: int = STATS_BACKFILL_DAYS) -> dict:
+    # Rebuilds the buckets of the last `days` days (up to the current hour)
+    # from the orders table, streamed page by page. Older buckets and the
+    # current hour keep their counts.
+    if not _BACKFILL_LOCK.acquire(blocking=False):
+        return {"ok": False, "error": "backfill_running"}
+    try:
+        t0 = time.time()
+        cutoff = now_utc().replace(minute=0, second=0, microsecond=0)
+        start = ROLLUP.day_start(cutoff - timedelta(days=days))
+        stale = now_utc() - timedelta(minutes=ORDER_TTL_MINUTES)
+        fresh = analytics.SalesRollup(PRODUCTS.keys(), tz_offset_hours=STATS_TZ_OFFSET_HOURS)
+        # orders read as pending may be paid/expired live while the scan runs;
+        # those events are buffered and replayed after the swap
+        ROLLUP.begin_backfill()
+        pending: Set[str] = set()
+        n = 0
+        for o in iter_orders_keyset(start, cutoff):
+            created = _parse_dt(o.get("created_at", ""))
+            if created is None:
+                continue
+            st = (o.get("status") or "pending").lower()
+            if st == "pending":
+                if created < stale:
+                    # expired but never polled, so nobody flipped it to cancelled
+                    st = "cancelled"
+                else:
+                    pending.add(o["id"])
+            fresh.add_order_row(o.get("product_id", ""), created, st, int(o.get("qty") or 1), int(o.get("amount_idr") or 0))
+            n += 1
+        ROLLUP.replace_window(fresh, start, cutoff, replay=pending)
+        ROLLUP.prune(now_utc())
+        sec = time.time() - t0
+        print(f"[STATS] backfill {days}d: {n} orders in {sec:.2f}s")
+        return {"ok": True, "orders": n, "days": days, "start": start.isoformat(), "seconds": round(sec, 3)}
+    finally:
+        ROLLUP.end_backfill()
+        _BACKFILL_LOCK.release()
+
 
 FAQ_ITEMS = [
     ("Bagaimana cara membeli produk di Impura?", "Pilih produk, klik beli, bayar QRIS sesuai nominal unik, lalu simpan Order ID untuk cek status. Setelah pembayaran diverifikasi, akun email akan tampil otomatis."),
@@ -277,8 +808,7 @@ FAQ_ITEMS = [
 
 @app.get("/", response_class=HTMLResponse)
 def home():
-    stock = get_stock_map()
-    sold = get_sold_map()
+    stock, sold = get_stock_sold_maps()
     total_sold = sum(sold.values())
     cards = ""
     for pid, p in PRODUCTS.items():
@@ -295,17 +825,24 @@ def home():
 
 @app.get("/ping")
 @app.head("/ping")
-def ping():
-    return JSONResponse({"status": "ok"})
+async def ping():
+    backend = "warming" if _SUPABASE_CLIENT is None else ("ready" if supabase.breaker.state == "closed" else "degraded")
+    return JSONResponse({"status": "ok", "backend": backend, "uptime_sec": int(time.time() - _PROCESS_T0)})
+
+@lru_cache(maxsize=None)
+def _static_page(name: str) -> str:
+    if name == "faq":
+        faq_items = "".join([f'<div class="faq-item"><h3>{q}</h3><p>{a}</p></div>' for q, a in FAQ_ITEMS])
+        return _tpl_render(FAQ_HTML, faq_items=faq_items, logo=LOGO_IMAGE_URL)
+    return _tpl_render(LOOKUP_HTML, logo=LOGO_IMAGE_URL)
 
 @app.get("/faq", response_class=HTMLResponse)
 def faq_page():
-    faq_items = "".join([f'<div class="faq-item"><h3>{q}</h3><p>{a}</p></div>' for q, a in FAQ_ITEMS])
-    return HTMLResponse(_tpl_render(FAQ_HTML, faq_items=faq_items, logo=LOGO_IMAGE_URL))
+    return HTMLResponse(_static_page("faq"))
 
 @app.get("/cek-order", response_class=HTMLResponse)
 def cek_order_page():
-    return HTMLResponse(_tpl_render(LOOKUP_HTML, logo=LOGO_IMAGE_URL))
+    return HTMLResponse(_static_page("cek-order"))
 
 @app.get("/checkout/{product_id}")
 def checkout(product_id: str, request: Request, qty: int = Query(1, ge=1, le=99)):
@@ -318,36 +855,48 @@ def checkout(product_id: str, request: Request, qty: int = Query(1, ge=1, le=99)
     oid = request.cookies.get(cookie_key)
     if oid:
         try:
-            r = supabase.table("orders").select("*").eq("id", oid).limit(1).execute()
-            if r.data:
-                order = r.data[0]
+            order = fetch_order(oid)
+            if order:
                 order, expired = _ensure_not_expired(order)
                 if not expired and (order.get("status") or "").lower() == "pending":
                     return RedirectResponse(url=f"/pay/{oid}", status_code=302)
         except Exception:
             pass
-    stock = int(get_stock_map().get(product_id, 0))
-    if stock <= 0:
+    order_id = str(uuid.uuid4())
+    qty = ledger_reserve(order_id, product_id, qty)
+    if qty <= 0:
         return HTMLResponse("<h3>Stok habis</h3>", status_code=400)
-    if qty > stock:
-        qty = stock
     base_price = int(PRODUCTS[product_id]["price"])
     unique_code = random.randint(101, 999)
     total = (base_price * int(qty)) + unique_code
-    order_id = str(uuid.uuid4())
-    ins = supabase.table("orders").insert({"id": order_id, "product_id": product_id, "qty": int(qty), "unit": int(base_price), "amount_idr": int(total), "status": "pending", "created_at": now_utc().isoformat(), "voucher_code": None}).execute()
+    created = now_utc()
+    try:
+        ins = supabase.table("orders").insert({"id": order_id, "product_id": product_id, "qty": int(qty), "unit": int(base_price), "amount_idr": int(total), "status": "pending", "created_at": created.isoformat(), "voucher_code": None}).execute()
+    except CircuitOpen:
+        # never sent, so no row can exist: free the stock right away
+        ledger_release(order_id)
+        raise
+    except BackendUnavailable:
+        # the insert may still have landed: keep the hold, the next reconcile
+        # either finds the pending row or drops the hold
+        raise
+    except Exception:
+        ledger_release(order_id)
+        raise
     if not ins.data:
+        ledger_release(order_id)
         return HTMLResponse("<h3>Gagal membuat order</h3><p>Cek RLS / key / schema orders.</p>", status_code=500)
+    ROLLUP.record_created(product_id, created, order_id)
+    _remember_order(ins.data[0])
     resp = RedirectResponse(url=f"/pay/{order_id}", status_code=302)
     resp.set_cookie(cookie_key, order_id, max_age=ORDER_TTL_MINUTES * 60, httponly=True, samesite="lax")
     return resp
 
 @app.get("/pay/{order_id}", response_class=HTMLResponse)
 def pay(order_id: str):
-    res = supabase.table("orders").select("*").eq("id", order_id).limit(1).execute()
-    if not res.data:
+    order = fetch_order(order_id)
+    if not order:
         return HTMLResponse("<h3>Order tidak ditemukan</h3>", status_code=404)
-    order = res.data[0]
     order, _ = _ensure_not_expired(order)
     st = (order.get("status") or "pending").lower()
     if st == "paid":
@@ -362,10 +911,9 @@ def pay(order_id: str):
 
 @app.get("/status/{order_id}", response_class=HTMLResponse)
 def status(order_id: str):
-    res = supabase.table("orders").select("*").eq("id", order_id).limit(1).execute()
-    if not res.data:
+    order = fetch_order(order_id)
+    if not order:
         return HTMLResponse("<h3>Order tidak ditemukan</h3>", status_code=404)
-    order = res.data[0]
     order, _ = _ensure_not_expired(order)
     st = (order.get("status") or "pending").lower()
     if st == "paid":
@@ -379,10 +927,9 @@ def status(order_id: str):
 
 @app.get("/voucher/{order_id}", response_class=HTMLResponse)
 def voucher(order_id: str):
-    res = supabase.table("orders").select("status,product_id,voucher_code").eq("id", order_id).limit(1).execute()
-    if not res.data:
+    order = fetch_order(order_id)
+    if not order:
         return HTMLResponse("<h3>Order tidak ditemukan</h3>", status_code=404)
-    order = res.data[0]
     if (order.get("status") or "").lower() != "paid":
         return HTMLResponse("<h3>Belum diverifikasi admin</h3><p>Silakan tunggu.</p>", status_code=400)
     code = order.get("voucher_code")
@@ -392,10 +939,9 @@ def voucher(order_id: str):
 
 @app.get("/api/order/{order_id}")
 def api_order(order_id: str):
-    res = supabase.table("orders").select("*").eq("id", order_id).limit(1).execute()
-    if not res.data:
+    order = fetch_order(order_id)
+    if not order:
         return JSONResponse({"ok": False, "error": "not_found"}, status_code=404)
-    order = res.data[0]
     order, _ = _ensure_not_expired(order)
     st = (order.get("status") or "pending").lower()
     created = _parse_dt(order.get("created_at", "")) or now_utc()
@@ -408,8 +954,7 @@ def api_stock():
 
 @app.get("/api/stats")
 def api_stats():
-    stock = get_stock_map()
-    sold = get_sold_map()
+    stock, sold = get_stock_sold_maps()
     return {"ok": True, "stock": stock, "sold": sold, "total_sold": sum(sold.values())}
 
 @app.get("/api/visitors")
@@ -453,13 +998,14 @@ def admin(token: Optional[str] = None):
             else:
                 action = f"<div class='muted'>Status: {st.upper()}</div><a class='lbtn' href='/pay/{oid}'>Buka Pay</a>"
             items += f"<div class='row'><div class='col'><div><b>{pid}</b> — Qty {qty} — Rp {rupiah(amt)}</div><div class='muted'>ID: {oid}</div><div class='muted'>{created}</div><div class='muted'>Status: {st}</div></div><div class='act'>{action}</div></div>"
-    return HTMLResponse(_tpl_render(ADMIN_HTML, items=items))
+    product_options = "".join([f"<option value='{pid}'>{p['name']}</option>" for pid, p in PRODUCTS.items()])
+    return HTMLResponse(_tpl_render(ADMIN_HTML, items=items, token=token, product_options=product_options))
 
 @app.post("/admin/verify/{order_id}")
 def admin_verify(order_id: str, token: Optional[str] = None):
     if not require_admin(token):
         return PlainTextResponse("Unauthorized", status_code=401)
-    res = supabase.table("orders").select("id,product_id,qty,status,voucher_code").eq("id", order_id).limit(1).execute()
+    res = supabase.table("orders").select("id,product_id,qty,amount_idr,status,created_at,voucher_code").eq("id", order_id).limit(1).execute()
     if not res.data:
         return PlainTextResponse("Order not found", status_code=404)
     order = res.data[0]
@@ -471,5 +1017,80 @@ def admin_verify(order_id: str, token: Optional[str] = None):
     if st == "cancelled":
         return HTMLResponse("<h3>Order sudah cancelled/expired</h3>", status_code=410)
     qty = int(order.get("qty") or 1)
-    claim_vouchers_for_order(order_id, pid, qty)
+    if claim_vouchers_for_order(order_id, pid, qty):
+        ROLLUP.record_paid(pid, _parse_dt(order.get("created_at", "")) or now_utc(), qty, int(order.get("amount_idr") or 0), order_id)
     return RedirectResponse(url=f"/voucher/{order_id}", status_code=303)
+
+@app.get("/admin/export")
+def admin_export(token: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None, fmt: str = Query("csv", pattern="^(csv|ndjson)$"), gz: bool = False):
+    if not require_admin(token):
+        return PlainTextResponse("Unauthorized", status_code=401)
+    end_dt = _parse_dt(end or "")
+    if end_dt is None:
+        end_dt = now_utc()
+    elif len(end or "") == 10:
+        end_dt += timedelta(days=1)
+    start_dt = _parse_dt(start or "") or (end_dt - timedelta(days=31))
+    if start_dt >= end_dt:
+        return PlainTextResponse("start harus lebih kecil dari end", status_code=400)
+    chunks = iter_orders_export(iter_orders_keyset(start_dt, end_dt), fmt)
+    filename = f"orders_{start_dt:%Y%m%d}_{end_dt:%Y%m%d}.{fmt}"
+    media = "text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson"
+    if gz:
+        chunks = gzip_stream(chunks)
+        filename += ".gz"
+        media = "application/gzip"
+    return StreamingResponse(chunks, media_type=media, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.post("/admin/vouchers/import")
+def admin_import_vouchers(token: Optional[str] = None, product_id: str = Form(...), file: UploadFile = File(...)):
+    if not require_admin(token):
+        return PlainTextResponse("Unauthorized", status_code=401)
+    if product_id not in PRODUCTS:
+        return JSONResponse({"ok": False, "error": "unknown_product"}, status_code=404)
+    lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        return import_vouchers(lines, product_id)
+    finally:
+        lines.detach()
+
+@app.get("/admin/stats")
+def admin_stats(token: Optional[str] = None, hours: int = Query(48, ge=1, le=24 * 14), days: int = Query(30, ge=1, le=366)):
+    if not require_admin(token):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    snap = ROLLUP.snapshot(now_utc(), hours=hours, days=days)
+    snap.update({"ok": True, "tz_offset_hours": STATS_TZ_OFFSET_HOURS, "stock": ledger_snapshot(), "backend": supabase.snapshot()})
+    return snap
+
+@app.post("/admin/stats/backfill")
+def admin_stats_backfill(token: Optional[str] = None, days: int = Query(STATS_BACKFILL_DAYS, ge=1, le=3660)):
+    if not require_admin(token):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    if _BACKFILL_LOCK.locked():
+        return JSONResponse({"ok": False, "error": "backfill_running"}, status_code=409)
+    threading.Thread(target=backfill_rollup, args=(days,), name="stats-backfill", daemon=True).start()
+    return JSONResponse({"ok": True, "started": True, "days": days}, status_code=202)
+
+@app.get("/admin/profile")
+def admin_profile(token: Optional[str] = None, seconds: float = Query(10, gt=0, le=PROFILE_MAX_SEC), interval_ms: float = Query(10, ge=1, le=1000), all: bool = False, lines: bool = False):
+    if not require_admin(token):
+        return PlainTextResponse("Unauthorized", status_code=401)
+    if not _PROFILE_LOCK.acquire(blocking=False):
+        return PlainTextResponse("Profiler sudah berjalan", status_code=409)
+    try:
+        only_dir = None if all else os.path.dirname(os.path.abspath(__file__))
+        res = profiler.sample_stacks(seconds, interval=interval_ms / 1000.0, lines=lines, only_dir=only_dir, exclude={threading.get_ident()})
+    finally:
+        _PROFILE_LOCK.release()
+    headers = {
+        "Content-Disposition": f'attachment; filename="profile-{now_utc():%Y%m%dT%H%M%S}.collapsed"',
+        "X-Profile-Samples": str(res["samples"]),
+        "X-Profile-Stacks": f"{res['stacks_kept']}/{res['stacks_seen']}",
+    }
+    return PlainTextResponse(res["collapsed"], headers=headers)
+
+@app.get("/admin/slow")
+def admin_slow(token: Optional[str] = None, limit: int = Query(50, ge=1, le=200)):
+    if not require_admin(token):
+        return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+    return {"ok": True, "threshold_ms": SLOW_LOG.threshold_ms, "seen": SLOW_LOG.seen, "requests": SLOW_LOG.slowest(limit)}
@@ -0,0 +1,217 @@
+"""Timeouts, circuit breaker and read hedging around Supabase calls.
+
+``GuardedClient`` wraps the (lazily created) Supabase client. Every
+``.execute()`` of a query builder runs on a bounded worker pool and:
+
+- for reads (no insert/update/upsert/delete in the chain), fails with
+  ``BackendUnavailable`` after ``timeout`` seconds instead of blocking the
+  request thread for as long as PostgREST takes. Writes are not cut short:
+  one abandoned by the caller could still commit, so they wait for their
+  real outcome, bounded by the HTTP client's own timeout;
+- is rejected immediately while the breaker is open, so a Supabase outage
+  costs callers microseconds, not a timeout each;
+- for reads, fires a second, identical request if the first hasn't
+  answered after ``hedge_after`` seconds and takes whichever returns
+  first. Hedges draw from a token bucket refilled by ``hedge_ratio`` per
+  call, so a latency spike can't double the load on Supabase.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Optional
+
+_WRITE_OPS = {"insert", "update", "upsert", "delete", "rpc"}
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class CircuitOpen(BackendUnavailable):
+    """Rejected by the open breaker: the request was never sent."""
+
+
+class CircuitBreaker:
+    def __init__(self, fail_threshold: int = 5, cooldown: float = 10.0):
+        self.fail_threshold = fail_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._probe = False
+            if self.state == "half_open" and not self._probe:
+                # let exactly one request through to test the water
+                self._probe = True
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != "closed":
+                print("[BACKEND] circuit closed")
+            self.state = "closed"
+            self.failures = 0
+            self._probe = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.fail_threshold):
+                if self.state == "closed":
+                    print(f"[BACKEND] circuit open after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                self._probe = False
+
+
+class GuardedClient:
+    def __init__(self, factory: Callable[[], Any], timeout: float = 5.0, hedge_after: Optional[float] = 0.3, hedge_ratio: float = 0.1, hedge_burst: float = 10.0, pool_size: int = 32, breaker: Optional[CircuitBreaker] = None, observer: Optional[Callable[[float], None]] = None):
+        self._factory = factory
+        self.observer = observer
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.hedge_ratio = hedge_ratio
+        self.hedge_burst = hedge_burst
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="supabase")
+        self._hedge_lock = threading.Lock()
+        self._hedge_tokens = hedge_burst
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_denied = 0
+
+    def table(self, name: str) -> "_GuardedQuery":
+        return _GuardedQuery(self, self._factory().table(name), False)
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+    def run(self, fn: Callable[[], Any], idempotent: bool) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return self._run(fn, idempotent)
+        finally:
+            if self.observer is not None:
+                self.observer(time.perf_counter() - t0)
+
+    def _take_hedge_token(self) -> bool:
+        with self._hedge_lock:
+            if self._hedge_tokens < 1.0:
+                self.hedges_denied += 1
+                return False
+            self._hedge_tokens -= 1.0
+            return True
+
+    def _run(self, fn: Callable[[], Any], idempotent: bool) -> Any:
+        if not self.breaker.allow():
+            raise CircuitOpen("circuit open")
+        self.calls += 1
+        with self._hedge_lock:
+            self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.hedge_ratio)
+        futures = []
+        try:
+            futures.append(self._pool.submit(fn))
+            first = futures[0]
+            if not idempotent:
+                result = first.result()
+            elif self.hedge_after and self.hedge_after < self.timeout and self.breaker.state == "closed":
+                done, _ = wait([first], timeout=self.hedge_after)
+                if done:
+                    result = first.result()
+                elif not self._take_hedge_token():
+                    result = first.result(timeout=self.timeout - self.hedge_after)
+                else:
+                    self.hedges += 1
+                    futures.append(self._pool.submit(fn))
+                    done, _ = wait(futures, timeout=self.timeout - self.hedge_after, return_when=FIRST_COMPLETED)
+                    if not done:
+                        raise FutureTimeout()
+                    winner = done.pop()
+                    if winner is futures[1]:
+                        self.hedge_wins += 1
+                    for f in futures:
+                        if f is not winner:
+                            f.cancel()
+                    result = winner.result()
+            else:
+                result = first.result(timeout=self.timeout)
+        except FutureTimeout:
+            # only reads get here; drop copies still queued behind a busy pool
+            for f in futures:
+                f.cancel()
+            self.timeouts += 1
+            self.breaker.failure()
+            raise BackendUnavailable(f"timeout after {self.timeout}s")
+        except Exception as e:
+            self.errors += 1
+            if _is_transport_error(e):
+                self.breaker.failure()
+                raise BackendUnavailable(str(e)) from e
+            # a 4xx from PostgREST means Supabase answered: not a health problem
+            self.breaker.success()
+            raise
+        self.breaker.success()
+        return result
+
+    def snapshot(self) -> dict:
+        b = self.breaker
+        return {
+            "state": b.state,
+            "failures": b.failures,
+            "trips": b.trips,
+            "rejected": b.rejected,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedges_denied": self.hedges_denied,
+            "hedge_tokens": round(self._hedge_tokens, 2),
+        }
+
+
+class _GuardedQuery:
+    def __init__(self, guard: GuardedClient, inner: Any, writes: bool):
+        self._guard = guard
+        self._inner = inner
+        self._writes = writes
+
+    def execute(self):
+        return self._guard.run(self._inner.execute, idempotent=not self._writes)
+
+    def __getattr__(self, name):
+        attr = getattr(self._inner, name)
+        if not callable(attr):
+            return attr
+        writes = self._writes or name in _WRITE_OPS
+
+        def call(*a, **kw):
+            out = attr(*a, **kw)
+            return _GuardedQuery(self._guard, out, writes) if hasattr(out, "execute") else out
+        return call
+
+
+def _is_transport_error(e: Exception) -> bool:
+    # PostgREST answered with an error body -> APIError; anything else
+    # (connect/read errors, DNS, 5xx gateway pages) counts against health.
+    if type(e).__name__ == "APIError":
+        code = str(getattr(e, "code", "") or "")
+        return code.startswith("5") or code in ("", "None")
+    return True
@@ -0,0 +1,392 @@
+"""Load-test / benchmark harness for app.py.
+
+Runs the FastAPI app in-process against ``fake_supabase.FakeBackend`` (no
+network, no credentials) and drives a few realistic traffic scenarios.
+Results are printed as JSON so two runs can be diffed::
+
+    python bench.py --latency-ms 40 --jitter-ms 20 --concurrency 50 > before.json
+    python bench.py --scenario poll --requests 5000 --out after.json
+    python bench.py --scenario export --export-rows 1000000 --mem-ceiling-mb 16
+    python bench.py --scenario startup --runs 5
+    python bench.py --scenario outage --requests 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import http.cookiejar
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+import zlib
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from fake_supabase import FakeBackend
+
+SCENARIOS = ("home", "checkout", "poll", "admin_verify")
+
+
+def load_app(backend: FakeBackend):
+    os.environ.setdefault("SUPABASE_URL", "http://fake.local")
+    os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "fake")
+    import app as app_module
+
+    # installed behind app.supabase (the guarded client) so timeouts and the breaker stay in the loop
+    app_module._SUPABASE_CLIENT = backend
+    return app_module
+
+
+def percentile(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(p / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(name: str, lat_ms: List[float], statuses: Dict[int, int], errors: int, wall: float) -> dict:
+    s = sorted(lat_ms)
+    return {
+        "scenario": name,
+        "requests": len(s),
+        "errors": errors,
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(len(s) / wall, 2) if wall > 0 else 0.0,
+        "mean_ms": round(sum(s) / len(s), 3) if s else 0.0,
+        "p50_ms": round(percentile(s, 50), 3),
+        "p95_ms": round(percentile(s, 95), 3),
+        "p99_ms": round(percentile(s, 99), 3),
+        "max_ms": round(s[-1], 3) if s else 0.0,
+    }
+
+
+async def drive(client: httpx.AsyncClient, name: str, make_req: Callable[[int], tuple], total: int, concurrency: int) -> dict:
+    lat_ms: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, headers = make_req(i)
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(method, url, headers=headers)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+                if r.status_code >= 500:
+                    errors += 1
+            except Exception:
+                errors += 1
+            lat_ms.append((time.perf_counter() - t0) * 1000.0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(name, lat_ms, statuses, errors, time.perf_counter() - t0)
+
+
+def make_pending_orders(app_module, backend: FakeBackend, n: int) -> List[str]:
+    ids = []
+    rows = []
+    for _ in range(n):
+        oid = app_module.uuid.uuid4().hex
+        pid = random.choice(list(app_module.PRODUCTS.keys()))
+        rows.append({"id": oid, "product_id": pid, "qty": 1, "unit": app_module.PRODUCTS[pid]["price"], "amount_idr": app_module.PRODUCTS[pid]["price"] + 123, "status": "pending", "created_at": app_module.now_utc().isoformat(), "voucher_code": None})
+        ids.append(oid)
+    backend.table("orders").insert(rows)._run()
+    return ids
+
+
+async def run(args) -> dict:
+    random.seed(args.seed)
+    backend = FakeBackend(latency_ms=0, jitter_ms=0, seed=args.seed)
+    app_module = load_app(backend)
+    pids = list(app_module.PRODUCTS.keys())
+    backend.seed_vouchers({pid: args.vouchers for pid in pids})
+    backend.seed_vouchers({pid: args.vouchers // 4 for pid in pids}, status="used")
+    backend.latency_ms = args.latency_ms
+    backend.jitter_ms = args.jitter_ms
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    out = {
+        "config": {
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "vouchers_per_product": args.vouchers,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+    wanted = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    # every simulated request is a different browser, so never replay cookies (oid_* would turn checkouts into redirects)
+    jar = http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", follow_redirects=False, timeout=None, cookies=jar) as client:
+        for name in wanted:
+            backend.calls.clear()
+            if name == "home":
+                def req(i):
+                    return ("GET", "/" if i % 5 == 0 else "/api/stats", None)
+            elif name == "checkout":
+                def req(i):
+                    return ("GET", f"/checkout/{pids[i % len(pids)]}?qty=1", {"x-forwarded-for": f"10.0.{i // 250}.{i % 250}"})
+            elif name == "poll":
+                ids = make_pending_orders(app_module, backend, max(1, args.concurrency))
+
+                def req(i, ids=ids):
+                    return ("GET", f"/api/order/{ids[i % len(ids)]}", None)
+            else:
+                ids = make_pending_orders(app_module, backend, args.requests)
+
+                def req(i, ids=ids):
+                    return ("POST", f"/admin/verify/{ids[i]}?token={app_module.ADMIN_TOKEN}", None)
+            res = await drive(client, name, req, args.requests, args.concurrency)
+            res["backend_calls"] = dict(backend.calls)
+            out["results"].append(res)
+    return out
+
+
+def seed_orders(app_module, backend: FakeBackend, n: int):
+    t0 = app_module.now_utc() - timedelta(days=120)
+    pids = list(app_module.PRODUCTS.keys())
+    statuses = ("paid", "paid", "cancelled", "pending")
+    rows = backend.tables.setdefault("orders", [])
+    for i in range(n):
+        pid = pids[i % len(pids)]
+        unit = app_module.PRODUCTS[pid]["price"]
+        # three orders per timestamp, so keyset pages regularly end inside a
+        # created_at tie and the (created_at, id) tie-break is exercised
+        rows.append({"id": f"{i:032x}", "product_id": pid, "qty": 1, "unit": unit, "amount_idr": unit + 101 + i % 899, "status": statuses[i % 4], "created_at": (t0 + timedelta(seconds=(i // 3) * 9)).isoformat(), "voucher_code": None})
+    backend._bump("orders")
+
+
+class ExportCheck:
+    """Counts exported rows and sums their (hex) ids while the body streams by."""
+
+    def __init__(self, fmt: str, gz: bool):
+        self.fmt = fmt
+        self.z = zlib.decompressobj(31) if gz else None
+        self.tail = b""
+        self.header = fmt == "csv"
+        self.rows = 0
+        self.id_sum = 0
+
+    def feed(self, chunk: bytes):
+        if self.z is not None:
+            chunk = self.z.decompress(chunk)
+        self._split(chunk)
+
+    def close(self):
+        if self.z is not None:
+            self._split(self.z.flush())
+        if self.tail:
+            self._line(self.tail)
+            self.tail = b""
+
+    def _split(self, data: bytes):
+        lines = (self.tail + data).split(b"\n")
+        self.tail = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def _line(self, line: bytes):
+        if self.header:
+            self.header = False
+            return
+        oid = line.split(b",", 1)[0] if self.fmt == "csv" else json.loads(line)["id"]
+        self.rows += 1
+        self.id_sum += int(oid, 16)
+
+
+async def run_export(args) -> dict:
+    backend = FakeBackend(latency_ms=0, jitter_ms=0, seed=args.seed)
+    app_module = load_app(backend)
+    seed_orders(app_module, backend, args.export_rows)
+    # build the fake's sort index up front so it isn't charged to the exporter
+    backend.table("orders").select("id").order("created_at").order("id").limit(1).execute()
+    backend.latency_ms = args.latency_ms
+    backend.jitter_ms = args.jitter_ms
+    # ids are i in hex, so sum(range(n)) catches a dropped row paired with a repeated one
+    expected_sum = args.export_rows * (args.export_rows - 1) // 2
+    results = []
+    for fmt, gz in (("csv", False), ("ndjson", True)):
+        # tracemalloc only sees allocations made after start(), so the seeded
+        # fake table is excluded and the peak is what the export path holds
+        tracemalloc.start()
+        resp = app_module.admin_export(token=app_module.ADMIN_TOKEN, start="2000-01-01", end=None, fmt=fmt, gz=gz)
+        nbytes = nchunks = 0
+        check = ExportCheck(fmt, gz)
+        t0 = time.perf_counter()
+        async for chunk in resp.body_iterator:
+            nbytes += len(chunk)
+            nchunks += 1
+            check.feed(chunk)
+        check.close()
+        wall = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+        tracemalloc.stop()
+        results.append({
+            "scenario": f"export_{fmt}{'_gz' if gz else ''}",
+            "rows": args.export_rows,
+            "bytes": nbytes,
+            "chunks": nchunks,
+            "wall_s": round(wall, 3),
+            "rows_per_s": round(args.export_rows / wall, 1) if wall > 0 else 0.0,
+            "peak_mem_mb": round(peak, 2),
+            "mem_ceiling_mb": args.mem_ceiling_mb,
+            "rows_exported": check.rows,
+            "id_checksum_ok": check.id_sum == expected_sum,
+            "ok": peak <= args.mem_ceiling_mb and check.rows == args.export_rows and check.id_sum == expected_sum,
+        })
+    return {"config": {"export_rows": args.export_rows, "latency_ms": args.latency_ms, "page_size": app_module.EXPORT_PAGE_SIZE}, "results": results}
+
+
+async def run_outage(args) -> dict:
+    # Fault injection: healthy -> Supabase hangs (latency far above the guard
+    # timeout) -> Supabase refuses connections -> recovered. Pollers and the
+    # home page must stay bounded by the guard timeout and then serve cached
+    # data fast while the breaker is open.
+    backend = FakeBackend(latency_ms=0, jitter_ms=0, seed=args.seed)
+    app_module = load_app(backend)
+    pids = list(app_module.PRODUCTS.keys())
+    backend.seed_vouchers({pid: args.vouchers for pid in pids})
+    ids = make_pending_orders(app_module, backend, max(1, args.concurrency))
+    guard = app_module.supabase
+    bound_ms = guard.timeout * 1000.0 + 250.0
+    phases = (
+        ("healthy", dict(latency_ms=args.latency_ms, down=False)),
+        ("hang", dict(latency_ms=guard.timeout * 1000.0 * 2, down=False)),
+        ("down", dict(latency_ms=args.latency_ms, down=True)),
+        ("recovered", dict(latency_ms=args.latency_ms, down=False)),
+    )
+    jar = http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    results = []
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", follow_redirects=False, timeout=None, cookies=jar) as client:
+        for name, knobs in phases:
+            for k, v in knobs.items():
+                setattr(backend, k, v)
+            if name == "recovered":
+                # wait out the cooldown (and the calls still stuck in the hang) so the
+                # half-open probe meets a healthy backend and closes the breaker
+                await asyncio.sleep(max(guard.breaker.cooldown, guard.timeout * 2))
+
+            def req(i):
+                if i % 10 == 0:
+                    return ("GET", "/", None)
+                if i % 10 == 1:
+                    return ("GET", "/api/stats", None)
+                return ("GET", f"/api/order/{ids[i % len(ids)]}", None)
+            res = await drive(client, name, req, args.requests, args.concurrency)
+            res["breaker"] = guard.snapshot()
+            res["bound_ms"] = round(bound_ms, 1)
+            res["ok"] = res["max_ms"] <= bound_ms if name != "healthy" else True
+            results.append(res)
+    return {"config": {"latency_ms": args.latency_ms, "timeout_s": guard.timeout, "cooldown_s": guard.breaker.cooldown, "concurrency": args.concurrency, "requests": args.requests}, "results": results}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_first_byte(port: int, deadline: float) -> Optional[float]:
+    req = b"GET /ping HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n"
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1.0) as s:
+                s.sendall(req)
+                if s.recv(1):
+                    return time.perf_counter()
+        except OSError:
+            time.sleep(0.005)
+    return None
+
+
+def run_startup(args) -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    # unroutable backend: startup must not depend on Supabase being reachable
+    env.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+    env.setdefault("SUPABASE_SERVICE_ROLE_KEY", "fake")
+    code = "import time;t=time.perf_counter();import app;print((time.perf_counter()-t)*1000)"
+    imports, ttfb = [], []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=here, env=env, capture_output=True, text=True, check=True)
+        imports.append(float(out.stdout.strip().splitlines()[-1]))
+        port = _free_port()
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"], cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            t1 = _wait_first_byte(port, t0 + 30)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if t1 is not None:
+            ttfb.append((t1 - t0) * 1000.0)
+    prof = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=here, env=env, capture_output=True, text=True)
+    top = []
+    for line in prof.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[0].startswith("import time:") and parts[1].strip().isdigit():
+            top.append((int(parts[1]), parts[2].rstrip()))
+    top.sort(reverse=True)
+
+    def stats(vals):
+        s = sorted(vals)
+        return {"runs": len(s), "min_ms": round(s[0], 1), "p50_ms": round(percentile(s, 50), 1), "max_ms": round(s[-1], 1)} if s else {"runs": 0}
+
+    return {
+        "config": {"runs": args.runs, "python": sys.version.split()[0]},
+        "results": [
+            dict(scenario="import_app", **stats(imports)),
+            dict(scenario="ttfb_ping_from_spawn", failed=args.runs - len(ttfb), **stats(ttfb)),
+            {"scenario": "importtime_top", "modules": [{"module": m.strip(), "cumulative_ms": round(us / 1000.0, 1)} for us, m in top[:15]]},
+        ],
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Benchmark app.py against an in-process fake Supabase")
+    ap.add_argument("--scenario", choices=("all", "export", "startup", "outage") + SCENARIOS, default="all")
+    ap.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--latency-ms", type=float, default=30.0, help="injected latency per Supabase call")
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--vouchers", type=int, default=2000, help="available vouchers seeded per product")
+    ap.add_argument("--export-rows", type=int, default=1_000_000, help="orders seeded for --scenario export")
+    ap.add_argument("--mem-ceiling-mb", type=float, default=16.0, help="max traced memory allowed while exporting")
+    ap.add_argument("--runs", type=int, default=5, help="process spawns for --scenario startup")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="", help="write JSON here instead of stdout")
+    args = ap.parse_args(argv)
+    # app.py logs with print(); keep stdout for the JSON report only
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.scenario == "startup":
+            result = run_startup(args)
+        elif args.scenario == "outage":
+            result = asyncio.run(run_outage(args))
+        else:
+            result = asyncio.run(run_export(args) if args.scenario == "export" else run(args))
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if any(r.get("ok") is False for r in result["results"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
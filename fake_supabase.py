@@ -0,0 +1,295 @@
+import bisect
+import copy
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class FakeResponse:
+    def __init__(self, data: List[dict]):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, backend: "FakeBackend", table: str):
+        self._backend = backend
+        self._table = table
+        self._op = "select"
+        self._cols: Optional[List[str]] = None
+        self._payload: Any = None
+        self._filters: List[tuple] = []
+        self._order: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+
+    def select(self, cols: str = "*", **kw):
+        self._op = "select"
+        cols = (cols or "*").strip()
+        self._cols = None if cols == "*" else [c.strip() for c in cols.split(",") if c.strip()]
+        return self
+
+    def insert(self, rows):
+        self._op = "insert"
+        self._payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, values: dict):
+        self._op = "update"
+        self._payload = dict(values)
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    def eq(self, col, val):
+        self._filters.append((col, "eq", val))
+        return self
+
+    def neq(self, col, val):
+        self._filters.append((col, "neq", val))
+        return self
+
+    def gt(self, col, val):
+        self._filters.append((col, "gt", val))
+        return self
+
+    def gte(self, col, val):
+        self._filters.append((col, "gte", val))
+        return self
+
+    def lt(self, col, val):
+        self._filters.append((col, "lt", val))
+        return self
+
+    def lte(self, col, val):
+        self._filters.append((col, "lte", val))
+        return self
+
+    def in_(self, col, vals):
+        self._filters.append((col, "in", set(vals)))
+        return self
+
+    def or_(self, filters: str):
+        self._filters.append(("", "or", _parse_or(filters)))
+        return self
+
+    def order(self, col, desc: bool = False):
+        self._order.append((col, desc))
+        return self
+
+    def limit(self, n: int):
+        self._limit = int(n)
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset = int(start)
+        self._limit = int(end) - int(start) + 1
+        return self
+
+    def _match(self, row: dict) -> bool:
+        for col, op, val in self._filters:
+            if op == "or":
+                if not any(all(_cmp(row, c, o, v) for c, o, v in branch) for branch in val):
+                    return False
+            elif not _cmp(row, col, op, val):
+                return False
+        return True
+
+    def _project(self, row: dict) -> dict:
+        if self._cols is None:
+            return dict(row)
+        return {c: row.get(c) for c in self._cols}
+
+    def execute(self) -> FakeResponse:
+        self._backend._before_call(self._table, self._op)
+        with self._backend.lock:
+            return FakeResponse(self._run())
+
+    def _run(self) -> List[dict]:
+        rows = self._backend.tables.setdefault(self._table, [])
+        if self._op == "insert":
+            out = []
+            for r in self._payload:
+                r = copy.deepcopy(r)
+                if "id" not in r or r["id"] is None:
+                    self._backend._seq[self._table] = self._backend._seq.get(self._table, 0) + 1
+                    r["id"] = self._backend._seq[self._table]
+                rows.append(r)
+                out.append(dict(r))
+            self._backend._bump(self._table)
+            return out
+        if self._op == "select" and self._order and not any(desc for _, desc in self._order):
+            return self._select_sorted(rows)
+        hits = [r for r in rows if self._match(r)]
+        if self._op == "update":
+            if hits:
+                self._backend._bump(self._table)
+            for r in hits:
+                r.update(self._payload)
+            return [dict(r) for r in hits]
+        if self._op == "delete":
+            self._backend._bump(self._table)
+            rows[:] = [r for r in rows if not self._match(r)]
+            return [dict(r) for r in hits]
+        for col, desc in reversed(self._order):
+            hits.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+        if self._offset:
+            hits = hits[self._offset:]
+        limit = self._backend._cap(self._limit)
+        if limit is not None:
+            hits = hits[:limit]
+        return [self._project(r) for r in hits]
+
+    def _select_sorted(self, rows: List[dict]) -> List[dict]:
+        # Acts like a btree index on the ORDER BY columns: seek to the lower
+        # bound of the first column, then scan only until LIMIT rows matched.
+        # Keeps keyset pagination over large fake tables O(page) per call.
+        cols = tuple(c for c, _ in self._order)
+        view = self._backend._sorted_view(self._table, cols)
+        first = cols[0]
+        lo = None
+        for col, op, val in self._filters:
+            if col == first and op in ("gt", "gte", "eq") and (lo is None or val > lo):
+                lo = val
+        start = bisect.bisect_left(view, (False, lo), key=lambda r: (r.get(first) is None, r.get(first))) if lo is not None else 0
+        limit = self._backend._cap(self._limit)
+        want = None if limit is None else self._offset + limit
+        out = []
+        for i in range(start, len(view)):
+            r = view[i]
+            if self._match(r):
+                out.append(r)
+                if want is not None and len(out) >= want:
+                    break
+        return [self._project(r) for r in out[self._offset:]]
+
+
+def _split_top(expr: str) -> List[str]:
+    parts, depth, quoted, cur = [], 0, False, []
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append("".join(cur))
+            cur = []
+        else:
+            cur.append(ch)
+    if cur:
+        parts.append("".join(cur))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _parse_clause(clause: str) -> tuple:
+    col, op, val = clause.split(".", 2)
+    if len(val) >= 2 and val[0] == '"' and val[-1] == '"':
+        val = val[1:-1]
+    return col, op, val
+
+
+def _parse_or(expr: str) -> List[List[tuple]]:
+    """Parse the PostgREST ``or=(...)`` grammar that ``or_()`` accepts (``and(...)`` groups one level deep)."""
+    branches = []
+    for part in _split_top(expr):
+        if part.startswith("and(") and part.endswith(")"):
+            branches.append([_parse_clause(c) for c in _split_top(part[4:-1])])
+        else:
+            branches.append([_parse_clause(part)])
+    return branches
+
+
+def _cmp(row: dict, col: str, op: str, val) -> bool:
+    cur = row.get(col)
+    if isinstance(val, str) and isinstance(cur, (int, float)) and not isinstance(cur, bool):
+        try:
+            val = type(cur)(val)
+        except ValueError:
+            return False
+    if op == "eq":
+        return cur == val
+    if op == "neq":
+        return cur != val
+    if op == "in":
+        return cur in val
+    if cur is None:
+        return False
+    if op == "gt":
+        return cur > val
+    if op == "gte":
+        return cur >= val
+    if op == "lt":
+        return cur < val
+    if op == "lte":
+        return cur <= val
+    raise ValueError(f"unsupported filter op: {op}")
+
+
+class FakeBackend:
+    """In-process stand-in for the Supabase client (PostgREST tables only).
+
+    Implements the subset of the query builder that app.py uses and sleeps
+    ``latency_ms`` (+ up to ``jitter_ms``) on every ``execute()`` to mimic
+    the network round trip to Supabase. For fault injection, ``fail_rate``
+    makes that fraction of calls raise ``ConnectionError`` after the delay
+    and ``down=True`` fails every call immediately. ``max_rows`` caps every
+    select like PostgREST's ``db-max-rows`` (1000 on Supabase).
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tables: Dict[str, List[dict]] = {"orders": [], "vouchers": []}
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.fail_rate = 0.0
+        self.down = False
+        self.max_rows: Optional[int] = None
+        self._seq: Dict[str, int] = {}
+        self._version: Dict[str, int] = {}
+        self._views: Dict[tuple, tuple] = {}
+        self._rng = random.Random(seed)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def _before_call(self, table: str, op: str):
+        key = f"{table}.{op}"
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            delay = self.latency_ms + (self._rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+            fail = self.fail_rate > 0 and self._rng.random() < self.fail_rate
+        if self.down:
+            raise ConnectionError("fake backend down")
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if fail:
+            raise ConnectionError("injected failure")
+
+    def _cap(self, limit: Optional[int]) -> Optional[int]:
+        if self.max_rows is None:
+            return limit
+        return self.max_rows if limit is None else min(limit, self.max_rows)
+
+    def _bump(self, table: str):
+        self._version[table] = self._version.get(table, 0) + 1
+
+    def _sorted_view(self, table: str, cols: tuple) -> List[dict]:
+        ver = self._version.get(table, 0)
+        cached = self._views.get((table, cols))
+        if cached and cached[0] == ver:
+            return cached[1]
+        view = sorted(self.tables.get(table, []), key=lambda r: tuple((r.get(c) is None, r.get(c)) for c in cols))
+        self._views[(table, cols)] = (ver, view)
+        return view
+
+    def seed_vouchers(self, per_product: Dict[str, int], status: str = "available"):
+        rows = []
+        for pid, n in per_product.items():
+            for i in range(n):
+                rows.append({"product_id": pid, "code": f"{pid}-{status}-{i}@mail.test", "status": status})
+        FakeQuery(self, "vouchers").insert(rows)._run()
@@ -0,0 +1,145 @@
+"""In-process sampling profiler and slow-request capture.
+
+``sample_stacks`` polls ``sys._current_frames()`` from a helper thread and
+returns collapsed stacks (``frame;frame;frame count`` per line), the input
+format of flamegraph.pl / speedscope / inferno. Nothing is hooked into the
+interpreter, so the cost is one stack walk per live thread per interval and
+zero when no profile is running.
+
+``SlowRequestMiddleware`` is a plain ASGI middleware that times every
+request and splits it into phases reported via ``add_phase`` (backend calls,
+template render, the rest). Requests slower than the threshold go into a
+fixed-size ring buffer.
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+_PHASES: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_phases", default=None)
+
+
+def _label(frame, lines: bool) -> str:
+    code = frame.f_code
+    name = os.path.basename(code.co_filename)
+    if lines:
+        return f"{code.co_name} ({name}:{frame.f_lineno})"
+    return f"{code.co_name} ({name})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.01, lines: bool = False, only_dir: Optional[str] = None, exclude: Optional[set] = None) -> Dict[str, object]:
+    """Sample every thread's stack for ``seconds``; returns collapsed text plus counters.
+
+    With ``only_dir`` set, stacks that never enter a file under that directory
+    (idle pool workers, the event loop waiting in select) are dropped.
+    """
+    counts: Dict[str, int] = {}
+    skip = set(exclude or ())
+    stats = {"samples": 0, "stacks_seen": 0, "stacks_kept": 0}
+
+    def run():
+        me = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for t in threading.enumerate():
+                names[t.ident] = t.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me or ident in skip:
+                    continue
+                stack = []
+                mine = only_dir is None
+                f = frame
+                while f is not None:
+                    stack.append(_label(f, lines))
+                    if not mine and f.f_code.co_filename.startswith(only_dir) and "site-packages" not in f.f_code.co_filename:
+                        mine = True
+                    f = f.f_back
+                stats["stacks_seen"] += 1
+                if not mine:
+                    continue
+                stats["stacks_kept"] += 1
+                stack.append(names.get(ident, f"thread-{ident}"))
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            stats["samples"] += 1
+            time.sleep(interval)
+
+    t0 = time.monotonic()
+    th = threading.Thread(target=run, name="profiler", daemon=True)
+    th.start()
+    th.join()
+    collapsed = "".join(f"{k} {v}\n" for k, v in sorted(counts.items(), key=lambda kv: -kv[1]))
+    return dict(stats, collapsed=collapsed, seconds=round(time.monotonic() - t0, 3), interval_ms=interval * 1000.0)
+
+
+def add_phase(name: str, seconds: float):
+    phases = _PHASES.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+        phases[name + "_n"] = phases.get(name + "_n", 0) + 1
+
+
+class SlowRequestLog:
+    def __init__(self, threshold_ms: float = 500.0, size: int = 200):
+        self.threshold_ms = threshold_ms
+        self.entries: deque = deque(maxlen=size)
+        self.seen = 0
+        self.lock = threading.Lock()
+
+    def record(self, entry: dict):
+        with self.lock:
+            self.seen += 1
+            if entry["total_ms"] >= self.threshold_ms:
+                self.entries.append(entry)
+
+    def slowest(self, limit: int = 50) -> List[dict]:
+        with self.lock:
+            items = list(self.entries)
+        return sorted(items, key=lambda e: -e["total_ms"])[:limit]
+
+
+class SlowRequestMiddleware:
+    def __init__(self, app, log: SlowRequestLog, skip: tuple = ()):
+        self.app = app
+        self.log = log
+        # paths that are slow by design (profiling, streaming exports) would
+        # push the real slow requests out of the ring buffer
+        self.skip = tuple(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.skip and scope.get("path", "").startswith(self.skip)):
+            return await self.app(scope, receive, send)
+        phases: Dict[str, float] = {}
+        token = _PHASES.set(phases)
+        t0 = time.perf_counter()
+        status = {"code": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _PHASES.reset(token)
+            total = (time.perf_counter() - t0) * 1000.0
+            backend = phases.get("backend", 0.0) * 1000.0
+            render = phases.get("render", 0.0) * 1000.0
+            # the query string is left out on purpose: admin URLs carry the token
+            self.log.record({
+                "at": datetime.now(timezone.utc).isoformat(),
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "status": status["code"],
+                "total_ms": round(total, 2),
+                "backend_ms": round(backend, 2),
+                "backend_calls": int(phases.get("backend_n", 0)),
+                "render_ms": round(render, 2),
+                "other_ms": round(max(0.0, total - backend - render), 2),
+            })
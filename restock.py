@@ -0,0 +1,35 @@
+"""Bulk-import voucher codes from a text/CSV file.
+
+    python restock.py gemini codes.txt
+    python restock.py chatgpt restock.csv --batch-size 1000
+
+Uses the same code path as ``POST /admin/vouchers/import``: the file is
+streamed line by line, codes already in ``vouchers`` are skipped through a
+hash index and the rest are inserted in batches.
+"""
+import argparse
+import contextlib
+import json
+import sys
+
+import app
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Import voucher codes into Supabase")
+    ap.add_argument("product_id", choices=sorted(app.PRODUCTS.keys()))
+    ap.add_argument("path", help="file with one code per line, or CSV with a 'code' column ('-' for stdin)")
+    ap.add_argument("--batch-size", type=int, default=app.IMPORT_BATCH_SIZE)
+    args = ap.parse_args(argv)
+    # app.py logs with print(); keep stdout for the JSON report only
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.path == "-":
+            report = app.import_vouchers(sys.stdin, args.product_id, batch_size=args.batch_size)
+        else:
+            with open(args.path, encoding="utf-8-sig", errors="replace", newline="") as f:
+                report = app.import_vouchers(f, args.product_id, batch_size=args.batch_size)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()